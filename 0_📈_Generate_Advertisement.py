@@ -2,6 +2,8 @@ import streamlit as st
 import core.utils
 import core.constants
 import core.generate_advertisement
+import core.pipeline
+import core.result_store
 from samples.generate_advertisement import samples
 
 if __name__ == '__main__':
@@ -14,19 +16,25 @@ if __name__ == '__main__':
 
     if 'request_classifier' not in st.session_state:
         st.session_state['request_classifier'] =\
-            core.generate_advertisement.get_request_classifier()
+            core.generate_advertisement.get_request_classifier(hedge=True)
 
     if 'keyword_generator' not in st.session_state:
         st.session_state['keyword_generator'] =\
-            core.generate_advertisement.get_keyword_generator()
+            core.generate_advertisement.get_keyword_generator(hedge=True)
 
     if 'banner_classifier' not in st.session_state:
         st.session_state['banner_classifier'] =\
-            core.generate_advertisement.get_banner_classifier()
+            core.generate_advertisement.get_banner_classifier(hedge=True)
 
     if 'banner_generator' not in st.session_state:
         st.session_state['banner_generator'] =\
-            core.generate_advertisement.get_banner_generator()
+            core.generate_advertisement.get_banner_generator(hedge=True)
+
+    if 'pipeline' not in st.session_state:
+        st.session_state['pipeline'] = core.pipeline.Pipeline()
+
+    if 'result_store' not in st.session_state:
+        st.session_state['result_store'] = core.result_store.ResultStore()
 
     if 'adgen_input' not in st.session_state:
         st.session_state['adgen_input'] = core.utils.choose(samples)
@@ -55,9 +63,15 @@ if __name__ == '__main__':
 #         num_workers=5,
 #     )
 
-def process(url, additional_info, keyword_temp, banner_temp):
+def process(
+    url, additional_info, keyword_temp, banner_temp,
+    crawl=False, num_banners=5, regenerate=False
+):
+    pipeline = st.session_state['pipeline']
+    if regenerate:
+        pipeline.forget_site(url, crawl)
     try:
-        title, content = core.generate_advertisement.get_title_and_content(url)
+        title, content = pipeline.site_content(url, crawl=crawl)
     except Exception:
         st.error('An error occurred while downloading data from the site. '
                  'Make sure the address is correct '
@@ -101,22 +115,46 @@ def process(url, additional_info, keyword_temp, banner_temp):
     tmp[1].header('Keywords:')
     '--------'
 
-    generated = False
+    params = {
+        'banner_temp': banner_temp, 'num_banners': num_banners,
+        'keyword_temp': keyword_temp, 'num_keywords': NUM_KEYWORDS,
+    }
+    store = st.session_state['result_store']
+    campaign = None
+    if not regenerate:
+        campaign = store.load(title, content, params)
+    cached = campaign is not None
+
+    generated = []
+    models = [
+        st.session_state[key] for key in [
+            'banner_generator', 'banner_classifier',
+            'keyword_generator', 'request_classifier'
+        ]
+    ]
+    wait_before = core.generate_advertisement.get_wait_stats(models)
+    hedge_before = core.generate_advertisement.get_hedge_stats(models)
 
     with st.spinner('Generating advertisement...'):
-        for banner, banner_keywords in\
-                core.generate_advertisement.generate_banner_keyword_parallel(
-                    st.session_state['banner_generator'],
-                    st.session_state['banner_classifier'],
-                    st.session_state['keyword_generator'],
-                    st.session_state['request_classifier'],
-                    title, content,
-                    banner_temp=banner_temp, num_banners=NUM_BANNERS,
-                    keyword_temp=1.1, num_keywords=NUM_KEYWORDS,
-                    score=True, retries=2,
-                    num_workers=NUM_BANNERS,
-                    num_kw_workers=4
-                ):
+        if not cached:
+            banners = pipeline.banners(
+                url, crawl,
+                st.session_state['banner_generator'],
+                st.session_state['banner_classifier'],
+                title, content,
+                banner_temp=banner_temp, num_banners=num_banners, retries=2,
+                num_workers=num_banners
+            )
+            campaign = pipeline.banner_keywords(
+                url, crawl,
+                st.session_state['keyword_generator'],
+                st.session_state['request_classifier'],
+                title, content, banners,
+                keyword_temp=keyword_temp, num_keywords=NUM_KEYWORDS,
+                num_workers=num_banners,
+                num_kw_workers=4
+            )
+        for banner, banner_keywords in campaign:
             c1, c2 = st.columns(2)
             with c1:
                 h, t = banner
@@ -128,7 +166,7 @@ def process(url, additional_info, keyword_temp, banner_temp):
                     ex = st.expander(t[0])
                     ex.bar_chart(t[1], x='Property', y='Score')
 
-            generated = True
+            generated.append((banner, banner_keywords))
             '--------'
 
     if not generated:
@@ -141,6 +179,33 @@ def process(url, additional_info, keyword_temp, banner_temp):
         )
         return
 
+    # partial campaigns (e.g. after server errors) are not worth serving
+    if not cached and len(generated) == num_banners:
+        store.save(url, title, content, params, generated)
+
+    wait_after = core.generate_advertisement.get_wait_stats(models)
+    if wait_before is not None and wait_after[0] > wait_before[0]:
+        st.caption(
+            'Rate limit: {} model calls (all sessions) waited {:.1f} s '
+            'in the queue meanwhile'.format(
+                wait_after[0] - wait_before[0],
+                wait_after[1] - wait_before[1]
+            )
+        )
+
+    hedge_after = core.generate_advertisement.get_hedge_stats(models)
+    if hedge_before is not None:
+        calls, hedged, wins = [
+            a - b for a, b in zip(hedge_after, hedge_before)
+        ]
+        if hedged:
+            st.caption(
+                'Slow model calls were resent: {} of {} calls '
+                '(all sessions), the resent one won {} times'.format(
+                    hedged, calls, wins
+                )
+            )
+
     st.caption(core.constants.generation_warning)
 
 
@@ -176,7 +241,19 @@ def main():
         max_chars=2000,
         height=200
     )
-    st.button("Generate!")
+    crawl = st.checkbox(
+        'Crawl key pages',
+        help="Also read a few internal pages of the site "
+        "(about, products, pricing), useful when the main page "
+        "has little text"
+    )
+    b1, b2 = st.columns(2)
+    b1.button("Generate!")
+    regenerate = b2.button(
+        "Regenerate",
+        help="Generate new banners and keywords instead of showing "
+        "the ones saved for this site and parameters"
+    )
     c1, c2 = st.columns(2)
     with c1:
         st.subheader('Banner generation parameters')
@@ -186,6 +263,10 @@ def main():
             help="With a decrease in creativity, correctness grows, "
             "with an increase in creativity, diversity grows"
         )
+        num_banners = st.slider(
+            'Number of banners', 1, 10, value=NUM_BANNERS,
+            key='num_banners'
+        )
     with c2:
         st.subheader('Keyword generation parameters')
         keywords_temp = st.slider(
@@ -195,7 +276,10 @@ def main():
             "with an increase in creativity, diversity grows"
         )
 
-    process(url, additional_info, keywords_temp, banner_temp)
+    process(
+        url, additional_info, keywords_temp, banner_temp,
+        crawl=crawl, num_banners=num_banners, regenerate=regenerate
+    )
 
 
 if __name__ == '__main__':
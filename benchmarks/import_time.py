@@ -0,0 +1,90 @@
+"""
+Import-time guard for the core package.
+
+    python benchmarks/import_time.py [--budget 20] [--runs 5]
+
+Imports each module in a fresh interpreter with `-X importtime`, and fails
+if a heavy dependency got imported eagerly. The best cumulative import time
+over several runs is reported relative to a bare interpreter start (site,
+encodings, ...) on the same machine; with --budget, a module slower than
+budget times that baseline fails as well.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+modules = [
+    'core.generate_advertisement',
+    'core.pipeline',
+    'core.result_store',
+    'core.utils',
+]
+
+# Must only be imported on first use.
+heavy_modules = [
+    'tune_the_model',
+    'pandas',
+    'numpy',
+    'langid',
+    'nltk',
+    'bs4',
+    'lxml',
+    'cloudscraper',
+    'core.parse_html',
+]
+
+
+def import_times(code):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=root, capture_output=True, text=True, check=True
+    )
+    # import time: self [us] | cumulative | imported package
+    # top level imports are indented by one space, nested ones by more
+    result = {}
+    top_level = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        result[name.strip()] = int(cumulative)
+        if not name.startswith('  '):
+            top_level += int(cumulative)
+    return result, top_level
+
+
+def best_of(code, runs):
+    return min(
+        (import_times(code) for _ in range(runs)), key=lambda x: x[1]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget', type=float)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    _, baseline = best_of('pass', args.runs)
+    print('{:<30} {:8.1f} ms'.format('bare interpreter', baseline / 1000))
+
+    failed = False
+    for module in modules:
+        times, _ = best_of('import ' + module, args.runs)
+        ratio = times[module] / baseline
+        eager = [m for m in heavy_modules if m in times]
+        ok = not eager and (args.budget is None or ratio <= args.budget)
+        failed |= not ok
+        print('{:<30} {:8.1f} ms  x{:<5.1f} {}'.format(
+            module, times[module] / 1000, ratio, 'ok' if ok else 'FAIL'
+        ))
+        if eager:
+            print('  eagerly imports: ' + ', '.join(eager))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+Batch generation of campaigns into the result store, at batch priority,
+so that interactive requests of the app get the rate limit first.
+
+    python -m core.batch [url ...]
+
+Without urls, generates for the app samples. Parameters match the app
+defaults, so the app then serves these campaigns from the store.
+"""
+import sys
+
+import core.generate_advertisement
+import core.pipeline
+import core.rate_limit
+import core.result_store
+
+
+def load_models():
+    return {
+        'banner_generator':
+            core.generate_advertisement.get_banner_generator(),
+        'banner_classifier':
+            core.generate_advertisement.get_banner_classifier(),
+        'keyword_generator':
+            core.generate_advertisement.get_keyword_generator(),
+        'request_classifier':
+            core.generate_advertisement.get_request_classifier(),
+    }
+
+
+def generate_campaign(
+    pipeline, store, models, url, crawl=False,
+    banner_temp=0.4, num_banners=5, keyword_temp=0.8, num_keywords=10,
+    priority=core.rate_limit.BATCH
+):
+    title, content = pipeline.site_content(url, crawl=crawl)
+    if core.generate_advertisement.is_bad_content(title, content):
+        return None
+    params = {
+        'banner_temp': banner_temp, 'num_banners': num_banners,
+        'keyword_temp': keyword_temp, 'num_keywords': num_keywords,
+    }
+    banners = pipeline.banners(
+        url, crawl,
+        models['banner_generator'], models['banner_classifier'],
+        title, content,
+        banner_temp=banner_temp, num_banners=num_banners, retries=2,
+        num_workers=num_banners, priority=priority
+    )
+    campaign = list(pipeline.banner_keywords(
+        url, crawl,
+        models['keyword_generator'], models['request_classifier'],
+        title, content, banners,
+        keyword_temp=keyword_temp, num_keywords=num_keywords,
+        num_workers=num_banners, num_kw_workers=4, priority=priority
+    ))
+    if len(campaign) == num_banners:
+        store.save(url, title, content, params, campaign)
+    return campaign
+
+
+def main(urls):
+    if not urls:
+        from samples.generate_advertisement import samples
+        urls = samples
+    pipeline = core.pipeline.Pipeline()
+    store = core.result_store.ResultStore()
+    models = load_models()
+    for url in urls:
+        try:
+            campaign = generate_campaign(pipeline, store, models, url)
+        except Exception as e:
+            print(url, 'failed:', e)
+            continue
+        print(url, len(campaign or []), 'banners')
+    stats = core.generate_advertisement.get_wait_stats(models.values())
+    if stats is not None:
+        print('{} model calls, {:.1f} s rate limit queue wait'.format(*stats))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
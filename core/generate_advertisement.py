@@ -1,58 +1,114 @@
-import tune_the_model as ttm
-import pandas as pd
-import numpy as np
-import core.parse_html
+# Heavy dependencies (tune_the_model, pandas, numpy, langid and the html
+# parsing stack) are imported on first use to keep import and worker
+# start-up cheap, see benchmarks/import_time.py.
 import time
-import langid
+import core.hedging
+import core.rate_limit
+import core.utils
 from concurrent.futures import ProcessPoolExecutor as Pool
 from functools import partial
 
 
-def get_title_and_content(url, num_retries=5):
+# content passed to the models is cut to this many characters
+max_content_len = 5000
+
+
+def get_title_and_content(url, num_retries=5, crawl=False, **limits):
+    # limits: max_bytes and max_text per fetch, see core.parse_html
+    import core.parse_html
+    # crawl mode already pulls extra pages, so thin content is not retried
+    parser = core.parse_html.page_parser
+    if crawl:
+        parser = partial(
+            core.parse_html.site_parser, max_content=max_content_len
+        )
     for retry in range(num_retries):
         try:
-            title, content = core.parse_html.page_parser(url)
+            title, content = parser(url, **limits)
         except Exception:
             time.sleep(1 + retry)
             continue
-        if len(title) + len(content) < 500 and retry < num_retries - 1:
+        if len(title) + len(content) < 500 and not crawl\
+                and retry < num_retries - 1:
             time.sleep(1 + retry)
             continue
-        content = content[:5000]
+        content = content[:max_content_len]
         return title, content
 
 
-def get_request_classifier():
-    return ttm.TuneTheModel.from_id(
-        '4cc5a4244e0611ed96478b0f9eb21374'  # autotarget, translated
+def load_model(model_id, hedge=False):
+    import tune_the_model as ttm
+    model = core.rate_limit.RateLimitedModel(
+        ttm.TuneTheModel.from_id(model_id), model_id
+    )
+    if hedge:
+        # hedges go through the rate limiter as well
+        model = core.hedging.HedgedModel(model)
+    return model
+
+
+def get_request_classifier(hedge=False):
+    return load_model(
+        '4cc5a4244e0611ed96478b0f9eb21374',  # autotarget, translated
+        hedge=hedge
     )
 
 
-def get_request_generator():
-    return ttm.TuneTheModel.from_id(
-        '2e515fe24e0611eda45161dc08b2d04c'  # autotarget, translated
+def get_request_generator(hedge=False):
+    return load_model(
+        '2e515fe24e0611eda45161dc08b2d04c',  # autotarget, translated
+        hedge=hedge
     )
 
 
-def get_keyword_generator():
-    return ttm.TuneTheModel.from_id(
-        '7bc2658a511e11ed966e1b318d0839ce'  # similarweb
+def get_keyword_generator(hedge=False):
+    return load_model(
+        '7bc2658a511e11ed966e1b318d0839ce',  # similarweb
+        hedge=hedge
     )
 
 
-def get_banner_generator():
-    return ttm.TuneTheModel.from_id(
-        'f5782c4c511a11ed9cbc2b904aa4d5aa'  # similarweb
+def get_banner_generator(hedge=False):
+    return load_model(
+        'f5782c4c511a11ed9cbc2b904aa4d5aa',  # similarweb
         # '09d6dd904e0611edbf82ff3a2de0976d' # autotarget, translated
+        hedge=hedge
     )
 
 
-def get_banner_classifier():
-    return ttm.TuneTheModel.from_id(
-        '2e96b14e220711ed9e95b1ae88b1dbe2'
+def get_banner_classifier(hedge=False):
+    return load_model(
+        '2e96b14e220711ed9e95b1ae88b1dbe2',
+        hedge=hedge
     )
 
 
+def get_wait_stats(models):
+    """
+    (calls, total wait) of the models in the rate limiter queue over every
+    process, None when they are not rate limited.
+    """
+    stats = [model.wait_stats() for model in models]
+    stats = [x for x in stats if x is not None]
+    if not stats:
+        return None
+    return sum(x[0] for x in stats), sum(x[1] for x in stats)
+
+
+def get_hedge_stats(models):
+    """
+    (calls, hedged, hedge wins) of the hedged models over every process,
+    None when none of them is hedged.
+    """
+    stats = [
+        model.hedge_stats() for model in models
+        if isinstance(model, core.hedging.HedgedModel)
+    ]
+    if not stats:
+        return None
+    return tuple(sum(x[i] for x in stats) for i in range(3))
+
+
 def get_banner_gen_prefix(title, content):
     # return title + '\n' + content + '\n\n\n' # autotarget
     return title + '\n' + content + '\n\nBanner\n'  # similarweb
@@ -109,9 +165,14 @@ def is_bad_content(title, content):
     return False
 
 
-def classify_request(request, request_classifier, title, content, banner):
+def classify_request(
+    request, request_classifier, title, content, banner,
+    priority=core.rate_limit.INTERACTIVE
+):
+    import pandas as pd
     scores = request_classifier.classify(
-        get_request_classify_prompt(title, content, banner, request)
+        get_request_classify_prompt(title, content, banner, request),
+        priority=priority
     )
     result = pd.DataFrame.from_dict(
         {'Property': request_classifier_mapping, 'Score': scores}
@@ -122,8 +183,9 @@ def classify_request(request, request_classifier, title, content, banner):
 def gen_keywords(
     keyword_generator, request_classifier,
     title, content, banner, temp=1.1, num_hypos=18,
-    num_workers=1
+    num_workers=1, priority=core.rate_limit.INTERACTIVE
 ):
+    import numpy as np
     if not isinstance(banner, str):
         h, t = banner
         banner = h + '\n' + t
@@ -131,7 +193,7 @@ def gen_keywords(
 
     result = keyword_generator.generate(
         model_input, num_hypos=num_hypos, min_tokens=4,
-        max_tokens=128, temperature=temp, top_k=30
+        max_tokens=128, temperature=temp, top_k=30, priority=priority
     )
 
     result = np.unique(result)
@@ -141,7 +203,8 @@ def gen_keywords(
             (
                 keyword,
                 classify_request(
-                    keyword, request_classifier, title, content, banner
+                    keyword, request_classifier, title, content, banner,
+                    priority=priority
                 )
             )
             for keyword in result
@@ -152,7 +215,8 @@ def gen_keywords(
                 partial(
                     classify_request,
                     request_classifier=request_classifier,
-                    title=title, content=content, banner=banner
+                    title=title, content=content, banner=banner,
+                    priority=priority
                 ),
                 result
             )
@@ -179,19 +243,22 @@ def prepare_banner(banner):
 
 # banner = [title, description]
 def is_good_banner(
-    banner, title, content, banner_classifier, score=True, threshold=0.3
+    banner, title, content, banner_classifier, score=True, threshold=0.3,
+    priority=core.rate_limit.INTERACTIVE
 ):
     if len(banner) <= 1:
         return False, 0
     if any(len(b) == 0 for b in banner):
         return False, 0
 
-    if langid.classify('\n'.join(banner))[0] != 'en':
+    if core.utils.classify_language('\n'.join(banner))[0] != 'en':
         return False, 0
 
     banner_classifier_input = '\n '.join(banner + [title, content[:200]])
     if score:
-        score = banner_classifier.classify(banner_classifier_input)[0]
+        score = banner_classifier.classify(
+            banner_classifier_input, priority=priority
+        )[0]
     else:
         score = 1.
 
@@ -201,8 +268,10 @@ def is_good_banner(
 def generate_banner(
     banner_generator, banner_classifier,
     title, content, temp=0.6, num_hypos=7,
-    retries=4, score=True, exceptions=True
+    retries=4, score=True, exceptions=True, with_scores=False,
+    priority=core.rate_limit.INTERACTIVE
 ):
+    import tune_the_model as ttm
     model_input = get_banner_gen_prefix(title, content)
     try:
         banners = [('', -1, False)] * num_hypos
@@ -214,20 +283,22 @@ def generate_banner(
 
             banners_cands = banner_generator.generate(
                 model_input, num_hypos=len(ids), min_tokens=4,
-                max_tokens=128, temperature=temp, top_k=30
+                max_tokens=128, temperature=temp, top_k=30,
+                priority=priority
             )
 
             for banner, idd in zip(banners_cands, ids):
                 banner = prepare_banner(banner)
 
-                is_good, score = is_good_banner(
-                    banner, title, content, banner_classifier, score=score
+                is_good, banner_score = is_good_banner(
+                    banner, title, content, banner_classifier, score=score,
+                    priority=priority
                 )
                 if is_good:
-                    banners[idd] = banner, score, True
+                    banners[idd] = banner, banner_score, True
                 else:
-                    if banners[idd][1] < score:
-                        banners[idd] = banner, score, False
+                    if banners[idd][1] < banner_score:
+                        banners[idd] = banner, banner_score, False
     except ttm.TuneTheModelException:
         if not exceptions:
             return []
@@ -237,7 +308,10 @@ def generate_banner(
     banners.sort(key=lambda x: -x[1])
 
     # discard bad banners (including non-english)
-    result = [b for b, score, b_ready in banners if b_ready]
+    result = [
+        (b, score) if with_scores else b
+        for b, score, b_ready in banners if b_ready
+    ]
 
     if not result:
         if not exceptions:
@@ -247,56 +321,78 @@ def generate_banner(
     return result
 
 
-def generate_banner_keyword(
+def generate_scored_banner(
     fake,
     banner_generator, banner_classifier,
-    keyword_generator, request_classifier,
     title, content,
-    banner_temp=0.6,
-    keyword_temp=1.1, num_keywords=18,
-    score=True, retries=2, num_kw_workers=4,
+    banner_temp=0.6, retries=2, priority=core.rate_limit.INTERACTIVE
 ):
     try:
-        banner = generate_banner(
+        return generate_banner(
             banner_generator, banner_classifier,
             title, content,
             temp=banner_temp, num_hypos=1, retries=retries,
-            exceptions=True
-        )[0]
-        keywords = gen_keywords(
+            exceptions=False, with_scores=True, priority=priority
+        )
+    except Exception:
+        return []
+
+
+def generate_banners_parallel(
+    banner_generator, banner_classifier,
+    title, content,
+    banner_temp=0.6, num_banners=5, retries=2,
+    num_workers=5, priority=core.rate_limit.INTERACTIVE
+):
+    # load once here, so forked workers share the model
+    core.utils.get_language_identifier()
+    with Pool(num_workers) as p:
+        for banners in p.map(
+            partial(generate_scored_banner,
+                banner_generator=banner_generator,
+                banner_classifier=banner_classifier,
+                title=title, content=content,
+                banner_temp=banner_temp, retries=retries,
+                priority=priority),
+            range(num_banners)
+        ):
+            yield from banners
+
+
+def generate_keywords(
+    banner,
+    keyword_generator, request_classifier,
+    title, content,
+    keyword_temp=1.1, num_keywords=18, num_kw_workers=4,
+    priority=core.rate_limit.INTERACTIVE
+):
+    try:
+        return gen_keywords(
             keyword_generator, request_classifier,
             title, content, banner,
             temp=keyword_temp, num_hypos=num_keywords,
-            num_workers=num_kw_workers
+            num_workers=num_kw_workers, priority=priority
         )
     except Exception:
-        return None, None
+        return None
 
-    return banner, keywords
 
-
-def generate_banner_keyword_parallel(
-    banner_generator, banner_classifier,
+def generate_keywords_parallel(
     keyword_generator, request_classifier,
-    title, content,
-    banner_temp=0.6, num_banners=5,
+    title, content, banners,
     keyword_temp=1.1, num_keywords=18,
-    score=True, retries=2,
-    num_workers=5, num_kw_workers=4
+    num_workers=5, num_kw_workers=4, priority=core.rate_limit.INTERACTIVE
 ):
     with Pool(num_workers) as p:
-        for banner, keywords in p.map(
-            partial(generate_banner_keyword,
-                banner_generator=banner_generator,
-                banner_classifier=banner_classifier,
+        for banner, keywords in zip(banners, p.map(
+            partial(generate_keywords,
                 keyword_generator=keyword_generator,
                 request_classifier=request_classifier,
                 title=title, content=content,
-                banner_temp=banner_temp,
                 keyword_temp=keyword_temp, num_keywords=num_keywords,
-                score=score, retries=retries, num_kw_workers=num_kw_workers),
-            range(num_banners)
-        ):
-            if banner is None:
+                num_kw_workers=num_kw_workers, priority=priority),
+            banners
+        )):
+            if keywords is None:
                 continue
             yield banner, keywords
@@ -0,0 +1,165 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import threading
+import time
+
+import core.rate_limit
+import core.shared_state
+
+
+class HedgedModel:
+    """
+    Wraps a model so that a generate or classify call which has not
+    returned by an adaptive deadline (the given percentile of recent
+    latencies for the same call kind) is sent once more, and the first
+    successful result wins. Every call earns budget hedge tokens, kept up
+    to burst, and each extra call spends one, so hedging stays within
+    budget of recent calls even after a long quiet stretch.
+
+    Latencies and counters are shared by every process of the user, so
+    copies pickled into pool workers hedge against the same history and
+    budget. When the wrapped model is a RateLimitedModel, its queue wait is
+    neither part of the latency nor of the time to the deadline.
+    """
+
+    def __init__(self, model, model_id=None, percentile=0.95, budget=0.1,
+                 burst=5, min_samples=20, default_deadline=10., window=200,
+                 max_workers=16):
+        self.model = model
+        self.model_id = model_id or model.model_id
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.default_deadline = default_deadline
+        self.window = window
+        self.max_workers = max_workers
+        # calls, hedged, hedge wins, hedge tokens
+        self.counters = core.shared_state.SharedRecord(
+            'hedge_' + self.model_id, 4
+        )
+        self._init_runtime()
+
+    def _init_runtime(self):
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock'], state['_pool']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_runtime()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.max_workers)
+            return self._pool
+
+    def _latencies(self, kind):
+        # count, next slot, samples
+        return core.shared_state.SharedRecord(
+            'hedge_{}_{}_{}'.format(self.model_id, *kind), 2 + self.window
+        )
+
+    def _record_latency(self, kind, latency):
+        with self._latencies(kind).update() as values:
+            if values is not None:
+                values[2 + int(values[1])] = latency
+                values[1] = (values[1] + 1) % self.window
+                values[0] = min(values[0] + 1, self.window)
+
+    def deadline(self, kind):
+        with self._latencies(kind).update() as values:
+            samples = sorted(values[2:2 + int(values[0])]) if values else []
+        if len(samples) < self.min_samples:
+            return self.default_deadline
+        return samples[min(len(samples) - 1,
+                           int(len(samples) * self.percentile))]
+
+    def _run(self, kind, name, args, kwargs, priority, started):
+        model = self.model
+        try:
+            if isinstance(model, core.rate_limit.RateLimitedModel):
+                model.acquire(
+                    core.rate_limit.call_cost(name, kwargs), priority
+                )
+                model = model.model
+        finally:
+            started.set()
+        start = time.monotonic()
+        result = getattr(model, name)(*args, **kwargs)
+        self._record_latency(kind, time.monotonic() - start)
+        return result
+
+    def _submit(self, kind, name, args, kwargs, priority):
+        started = threading.Event()
+        future = self._get_pool().submit(
+            self._run, kind, name, args, kwargs, priority, started
+        )
+        return future, started
+
+    def _take_hedge(self):
+        with self.counters.update() as values:
+            if values is None or values[3] < 1:
+                return False
+            values[3] -= 1
+            values[1] += 1
+            return True
+
+    def _count_call(self):
+        with self.counters.update() as values:
+            if values is not None:
+                values[0] += 1
+                values[3] = min(values[3] + self.budget, self.burst)
+
+    def _count_win(self):
+        with self.counters.update() as values:
+            if values is not None:
+                values[2] += 1
+
+    def _call(self, name, args, kwargs, priority):
+        # latency grows with the number of hypotheses asked for
+        kind = name, kwargs.get('num_hypos', 1)
+        primary, started = self._submit(kind, name, args, kwargs, priority)
+        self._count_call()
+        started.wait()
+        done, _ = wait([primary], timeout=self.deadline(kind))
+        if done or not self._take_hedge():
+            return primary.result()
+
+        hedge, _ = self._submit(kind, name, args, kwargs, priority)
+        pending = [primary, hedge]
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: f is hedge):
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count_win()
+                    return future.result()
+        return primary.result()
+
+    def generate(self, *args, priority=core.rate_limit.INTERACTIVE,
+                 **kwargs):
+        return self._call('generate', args, kwargs, priority)
+
+    def classify(self, *args, priority=core.rate_limit.INTERACTIVE,
+                 **kwargs):
+        return self._call('classify', args, kwargs, priority)
+
+    def hedge_stats(self):
+        """
+        (calls, hedged, hedge wins) of the model over every process.
+        """
+        with self.counters.update() as values:
+            if values is None:
+                return 0, 0, 0
+            return tuple(int(x) for x in values[:3])
+
+    def __getattr__(self, name):
+        model = self.__dict__.get('model')
+        if model is None:
+            raise AttributeError(name)
+        return getattr(model, name)
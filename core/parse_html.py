@@ -1,11 +1,15 @@
 from dataclasses import dataclass, field
 from typing import List, Dict
-import requests
-
-import lxml.html
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urljoin, urldefrag, urlparse
+import codecs
+import itertools
+import threading
+import time
+
+import lxml.etree
 import re
 
-from bs4 import BeautifulSoup
 import cloudscraper
 
 
@@ -75,121 +79,277 @@ class Segment:
         self.features[key] = value
 
 
-def parse_title(doc) -> str:
-    """
-    Depends on:
+# Per fetch limits: body bytes read, and extracted text characters after
+# which the rest of the page is not parsed.
+default_max_bytes = 2 * 1024 * 1024
+default_max_text = 50000
+chunk_size = 64 * 1024
+
+html_content_types = ('text/html', 'application/xhtml+xml')
+
+_header_re = re.compile('^h[1-6]$')
+_charset_re = re.compile(r'charset=["\']?([\w.:-]+)', re.I)
+_meta_charset_re = re.compile(
+    rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.I
+)
+
 
-    - doc.html
+def is_html(content_type, head):
+    mime = content_type.split(';')[0].strip().lower()
+    if mime:
+        return mime in html_content_types
+    return b'\x00' not in head[:1024]
+
+
+def sniff_charset(content_type, head):
     """
-    if not doc.html:
-        return ''
+    Charset from the Content-Type header, a BOM or a meta tag in the first
+    chunk of the body, utf-8 otherwise.
+    """
+    match = _charset_re.search(content_type)
+    if match:
+        charset = match.group(1)
+    elif head.startswith(codecs.BOM_UTF8):
+        charset = 'utf-8-sig'
+    else:
+        match = _meta_charset_re.search(head[:4096])
+        charset = match.group(1).decode('ascii') if match else 'utf-8'
     try:
-        return lxml.html.fromstring(doc.html).findtext('.//title') or ''
-    except (UnicodeDecodeError, lxml.html.etree.ParserError):
-        return ''
+        return codecs.lookup(charset).name
+    except LookupError:
+        return 'utf-8'
 
 
-def parse_content(doc) -> Toc:
+def remaining(deadline):
     """
-    Depends on:
-
-    - doc.title
-    - doc.html
+    Seconds left until a time.monotonic() deadline, None if there is none.
     """
-    # Toc tree.
-    toc = Toc(title=doc.title, own_segments=[], children=[])
-
-    # Find all paragraphs and headers.
-    document = BeautifulSoup(doc.html, "lxml")
-    simple_text = document.get_text(' ')
+    if deadline is None:
+        return None
+    return max(0., deadline - time.monotonic())
 
-    titles = []
-    descriptions = []
 
-    for meta in document.find_all('meta'):
-        prop = meta.attrs.get('property', '')
-        name = meta.attrs.get('name', '')
-        text = meta.attrs.get('content', '')
-        for tp in [prop, name]:
-            if 'title' in tp:
-                titles.append(text)
-            if 'site_name' in tp:
-                titles.append(text)
-            if 'description' in tp:
-                descriptions.append(text)
-    meta_title = '. '.join(titles)
-    meta_descr = ' '.join(descriptions)
+def stream_html(
+    response, max_bytes=default_max_bytes, deadline=None, stop=None
+):
+    """
+    Decoded text chunks of a streamed response body, at most max_bytes of
+    it, and stops reading once the time.monotonic() deadline has passed or
+    the stop event is set.
+    Returns None without reading further if the body is not HTML.
+    """
+    chunks = response.iter_content(chunk_size)
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= 4096:
+            break
+    content_type = response.headers.get('Content-Type', '')
+    if not is_html(content_type, head):
+        response.close()
+        return None
+    decoder = codecs.getincrementaldecoder(
+        sniff_charset(content_type, head)
+    )(errors='replace')
 
-    all_nodes = document.find_all(re.compile("^h[1-6]$|^p$"))
+    def decoded():
+        received = 0
+        try:
+            for chunk in itertools.chain([head], chunks):
+                chunk = chunk[:max_bytes - received]
+                received += len(chunk)
+                yield decoder.decode(chunk)
+                if received >= max_bytes or remaining(deadline) == 0:
+                    break
+                if stop is not None and stop.is_set():
+                    break
+            yield decoder.decode(b'', final=True)
+        finally:
+            response.close()
 
-    # Collect.
-    current_toc = [toc]
-    current_toc_level = [0]
+    return decoded()
 
-    for node in all_nodes:
-        # - Append paragraph.
-        if node.name == 'p':
-            seg = Segment(text=node.getText())
-            current_toc[-1].own_segments.append(seg)
 
-        # - Process title.
-        else:
-            level = int(node.name[1:])
+def cleanup(text):
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text
 
-            while current_toc_level[-1] >= level:
-                del current_toc[-1]
-                del current_toc_level[-1]
 
-            child = Toc(
-                title=node.getText().strip(),
-                own_segments=[],
-                children=[]
-            )
-            current_toc[-1].children.append(child)
-            current_toc.append(child)
-            current_toc_level.append(level)
+class DocBuilder:
+    """
+    lxml parser target collecting the toc, text, title, meta title and
+    description and links of a page on the fly, without building the
+    document tree.
+    """
 
-    return toc, simple_text, meta_title, meta_descr
+    skip_tags = ('script', 'style', 'noscript', 'template')
+
+    def __init__(self, max_text=default_max_text):
+        self.max_text = max_text
+        self.toc = Toc(title='', own_segments=[], children=[])
+        self.current_toc = [self.toc]
+        self.current_toc_level = [0]
+        self.title = None
+        self.titles = []
+        self.descriptions = []
+        self.links = []
+        self.text = []
+        self.text_len = 0
+        # text of the current run, lxml may split it into several calls
+        self.run = []
+        self.skip = 0
+        # outermost title, paragraph or header being read, and its text
+        self.node = None
+        self.node_text = []
+        self.link = None
 
+    @property
+    def done(self):
+        return self.text_len >= self.max_text
+
+    def start(self, tag, attrib):
+        self._end_run()
+        if tag in self.skip_tags:
+            self.skip += 1
+        elif tag == 'meta':
+            prop = attrib.get('property', '')
+            name = attrib.get('name', '')
+            text = attrib.get('content', '')
+            for tp in [prop, name]:
+                if 'title' in tp:
+                    self.titles.append(text)
+                if 'site_name' in tp:
+                    self.titles.append(text)
+                if 'description' in tp:
+                    self.descriptions.append(text)
+        elif tag == 'a':
+            self._end_link()
+            if attrib.get('href'):
+                self.link = attrib['href'], []
+        elif self.node is None and (
+            tag in ('title', 'p') or _header_re.match(tag)
+        ):
+            self.node = tag
+            self.node_text = []
+
+    def end(self, tag):
+        self._end_run()
+        if tag in self.skip_tags:
+            self.skip = max(0, self.skip - 1)
+        elif tag == 'a':
+            self._end_link()
+        elif tag == self.node:
+            self._end_node()
+
+    def data(self, data):
+        if self.skip:
+            return
+        self.run.append(data)
+        self.text_len += len(data)
+        if self.node is not None:
+            self.node_text.append(data)
+        if self.link is not None:
+            self.link[1].append(data)
+
+    def close(self):
+        self._end_run()
+        self._end_link()
+        if self.node is not None:
+            self._end_node()
+        return self
+
+    def _end_run(self):
+        if self.run:
+            self.text.append(''.join(self.run))
+            self.run = []
+
+    def _end_link(self):
+        if self.link is not None:
+            href, text = self.link
+            self.links.append((href, ''.join(text)))
+            self.link = None
+
+    def _end_node(self):
+        tag, text = self.node, ''.join(self.node_text)
+        self.node = None
+        if tag == 'title':
+            if self.title is None:
+                self.title = text
+        elif tag == 'p':
+            seg = Segment(text=text)
+            self.current_toc[-1].own_segments.append(seg)
+        else:
+            level = int(tag[1:])
 
-def download(url: str, timeout: int = 5) -> bytes:
-    try:
-        headers = {
-            'User-Agent':
-                'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) '
-                'AppleWebKit/537.36 (KHTML, like Gecko) '
-                'Chrome/39.0.2171.95 '
-                'Safari/537.36'
-        }
-        response = requests.get(url, timeout=timeout, headers=headers)
-        if response.ok:
-            return response.content
-    except Exception:
-        pass
-    return None
+            while self.current_toc_level[-1] >= level:
+                del self.current_toc[-1]
+                del self.current_toc_level[-1]
 
+            child = Toc(title=text.strip(), own_segments=[], children=[])
+            self.current_toc[-1].children.append(child)
+            self.current_toc.append(child)
+            self.current_toc_level.append(level)
 
-def download_cloudscraper(url: str):
+    def doc(self, url="", pos=0) -> Doc:
+        """
+        Meta title and description, and links as (href, anchor text) are
+        kept in doc.toc features.
+        """
+        meta_title = '. '.join(self.titles)
+        doc = Doc(
+            pos, url, '', title=self.title or meta_title,
+            text=' '.join(self.text), toc=self.toc
+        )
+        self.toc.title = doc.title
+        self.toc['meta_title'] = meta_title
+        self.toc['meta_descr'] = ' '.join(self.descriptions)
+        self.toc['links'] = self.links
+        return doc
+
+
+def parse_stream(chunks, url="", pos=0, max_text=default_max_text) -> Doc:
+    """
+    Feeds decoded html chunks to the parser until max_text characters of
+    text are extracted.
+    """
+    builder = DocBuilder(max_text)
+    parser = lxml.etree.HTMLParser(target=builder)
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+            if builder.done:
+                break
+        parser.close()
+    except lxml.etree.LxmlError:
+        builder.close()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    return builder.doc(url, pos)
+
+
+def fetch_doc(
+    url, pos=0, deadline=None,
+    max_bytes=default_max_bytes, max_text=default_max_text, stop=None
+):
+    if remaining(deadline) == 0:
+        return None
     scraper = cloudscraper.create_scraper()
     try:
-        return scraper.get(url).text
+        chunks = stream_html(
+            scraper.get(url, timeout=remaining(deadline), stream=True),
+            max_bytes, deadline, stop
+        )
+        if chunks is None:
+            return None
+        return parse_stream(chunks, url, pos, max_text)
     except Exception:
         return None
 
 
-def cleanup(text):
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
-
-
-def html_parser(html, url=""):
-    if not html:
-        return "", ""
-    doc = Doc(0, url, html, title='', text='', toc=None)
-    doc.title = parse_title(doc)
-    doc.toc, doc.text, meta_title, meta_descr = parse_content(doc)
-    if not doc.title:
-        doc.title = meta_title
+def doc_content(doc):
+    meta_title = doc.toc['meta_title']
+    meta_descr = doc.toc['meta_descr']
     content = '\n'.join([s.text for s in doc.toc.all_segments])
     if not content:
         content = doc.text
@@ -198,7 +358,15 @@ def html_parser(html, url=""):
     return cleanup(doc.title), cleanup(content)
 
 
-def page_parser(url):
+def html_parser(html, url="", max_text=default_max_text):
+    if not html:
+        return "", ""
+    if isinstance(html, bytes):
+        html = html.decode(sniff_charset('', html[:4096]), errors='replace')
+    return doc_content(parse_stream([html], url, max_text=max_text))
+
+
+def url_variants(url):
     variants = [url]
     if 'www.' not in url:
         if '://' in url:
@@ -212,13 +380,151 @@ def page_parser(url):
             new_var.append('https://' + url)
             new_var.append('http://' + url)
     new_var.extend(variants)
-    variants = new_var
+    return new_var
+
+
+def fetch_landing(
+    url, deadline=None,
+    max_bytes=default_max_bytes, max_text=default_max_text
+):
+    doc = None
+    for url in url_variants(url):
+        doc = fetch_doc(url, 0, deadline, max_bytes, max_text)
+        if doc is not None and (doc.title or doc.text.strip()):
+            break
+    return doc
+
+
+def page_parser(
+    url, max_bytes=default_max_bytes, max_text=default_max_text
+):
+    doc = fetch_landing(url, None, max_bytes, max_text)
+    if doc is None:
+        return "", ""
+    return doc_content(doc)
 
-    for url in variants:
-        try:
-            html = download_cloudscraper(url)
-            if html:
+
+# Pages that usually describe what the advertiser sells, by priority.
+key_page_patterns = [
+    'about',
+    'product',
+    'pricing',
+    'price',
+    'service',
+    'solution',
+    'feature',
+    'shop',
+    'catalog',
+    'company',
+]
+
+
+def _host(url):
+    host = urlparse(url).netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+
+def find_key_links(links, url, max_links=3) -> List[str]:
+    """
+    Internal links, given as (href, anchor text), whose path or anchor
+    text matches key_page_patterns, ordered by pattern priority.
+    """
+    host = _host(url)
+    page = urldefrag(url)[0].rstrip('/')
+    ranked = {}
+    for href, text in links:
+        link = urldefrag(urljoin(url, href.strip()))[0]
+        parsed = urlparse(link)
+        if parsed.scheme not in ('http', 'https') or _host(link) != host:
+            continue
+        if link.rstrip('/') == page:
+            continue
+        anchor = (parsed.path + ' ' + text).lower()
+        for rank, pattern in enumerate(key_page_patterns):
+            if pattern in anchor:
+                if rank < ranked.get(link, len(key_page_patterns)):
+                    ranked[link] = rank
+                break
+
+    links = sorted(ranked, key=lambda link: (ranked[link], len(link)))
+    return links[:max_links]
+
+
+def merge_tocs(title, tocs) -> Toc:
+    """
+    Joins page tocs under one root, dropping segments already seen
+    on previous pages (menus, footers, repeated blurbs).
+    """
+    toc = Toc(title=title, own_segments=[], children=[])
+    seen = set()
+    for child in tocs:
+        for node in child.all:
+            segments = []
+            for seg in node.own_segments:
+                key = cleanup(seg.text).lower()
+                if not key or key in seen:
+                    continue
+                seen.add(key)
+                segments.append(seg)
+            node.own_segments = segments
+        toc.children.append(child)
+    return toc
+
+
+def site_parser(
+    url, max_pages=4, time_budget=10,
+    max_bytes=default_max_bytes, max_text=default_max_text,
+    max_content=None
+):
+    """
+    Bounded crawl: the landing page plus up to max_pages - 1 key internal
+    pages, fetched concurrently. The whole crawl takes at most time_budget
+    seconds, pages not downloaded by then are skipped or cut short.
+    With max_content, the crawl stops once that much content is collected.
+    """
+    deadline = time.monotonic() + time_budget
+    landing = fetch_landing(url, deadline, max_bytes, max_text)
+    if landing is None:
+        return "", ""
+    collected = len(doc_content(landing)[1])
+    if max_content is not None and collected >= max_content:
+        return doc_content(landing)
+
+    docs = [landing]
+    links = find_key_links(
+        landing.toc['links'], landing.url, max_links=max_pages - 1
+    )
+    if links:
+        stop = threading.Event()
+        pool = ThreadPoolExecutor(len(links))
+        pending = [
+            pool.submit(
+                fetch_doc, link, pos, deadline, max_bytes, max_text, stop
+            )
+            for pos, link in enumerate(links, 1)
+        ]
+        while pending:
+            done, pending = wait(
+                pending, timeout=remaining(deadline),
+                return_when=FIRST_COMPLETED
+            )
+            if not done:
+                break
+            for future in done:
+                if future.result() is not None:
+                    docs.append(future.result())
+                    collected += len(doc_content(future.result())[1])
+            if max_content is not None and collected >= max_content:
                 break
-        except Exception:
-            pass
-    return html_parser(html, url)
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+        docs.sort(key=lambda doc: doc.pos)
+
+    toc = merge_tocs(landing.title, [doc.toc for doc in docs])
+    toc['meta_title'] = landing.toc['meta_title']
+    toc['meta_descr'] = landing.toc['meta_descr']
+    text = ' '.join(doc.text for doc in docs)
+    site = Doc(0, landing.url, '', title=landing.title, text=text, toc=toc)
+    return doc_content(site)
@@ -0,0 +1,137 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List
+import hashlib
+
+import core.generate_advertisement
+import core.rate_limit
+
+
+def content_key(title, content):
+    return hashlib.sha1((title + '\n' + content).encode()).hexdigest()
+
+
+@dataclass
+class SiteResults:
+    title: str
+    content: str
+    # (content_key, banner_temp) -> [(banner, score)], best first
+    banner_pools: Dict = field(default_factory=dict)
+    # (content_key, banner, keyword_temp, num_keywords) -> keywords
+    keyword_pools: Dict = field(default_factory=dict)
+
+
+class Pipeline:
+    """
+    Per-session cache of intermediate generation results.
+
+    Stages depend on each other as
+
+        page content (url, crawl)
+          -> banner pool (content, banner_temp)
+            -> keywords (content, banner, keyword_temp, num_keywords)
+
+    and each stage is keyed by its own parameters plus the content it was
+    computed from, so a changed UI parameter only recomputes the stages
+    below it. Banner pools keep every scored candidate, so asking for more
+    or fewer banners draws from the pool before generating new ones.
+    """
+
+    def __init__(self, max_sites=8):
+        self.max_sites = max_sites
+        self.sites = OrderedDict()
+
+    def _site(self, url, crawl):
+        site = self.sites.get((url, crawl))
+        if site is not None:
+            self.sites.move_to_end((url, crawl))
+        return site
+
+    def site_content(self, url, crawl=False):
+        site = self._site(url, crawl)
+        if site is None:
+            title, content = core.generate_advertisement.get_title_and_content(
+                url, crawl=crawl
+            )
+            site = SiteResults(title, content)
+            # blocked or thin pages are fetched again on the next try
+            if not core.generate_advertisement.is_bad_content(
+                title, content
+            ):
+                self.sites[(url, crawl)] = site
+                while len(self.sites) > self.max_sites:
+                    self.sites.popitem(last=False)
+        return site.title, site.content
+
+    def forget_site(self, url, crawl=False):
+        """
+        Drops everything cached for a site, its content included.
+        """
+        self.sites.pop((url, crawl), None)
+
+    def banners(
+        self, url, crawl,
+        banner_generator, banner_classifier,
+        title, content,
+        banner_temp=0.6, num_banners=5, retries=2, num_workers=5,
+        priority=core.rate_limit.INTERACTIVE
+    ) -> List:
+        site = self._site(url, crawl) or SiteResults(title, content)
+        pool = site.banner_pools.setdefault(
+            (content_key(title, content), banner_temp), []
+        )
+        if len(pool) < num_banners:
+            known = {tuple(b) for b, score in pool}
+            missing = num_banners - len(pool)
+            for banner, score in\
+                    core.generate_advertisement.generate_banners_parallel(
+                        banner_generator, banner_classifier,
+                        title, content,
+                        banner_temp=banner_temp, num_banners=missing,
+                        retries=retries,
+                        num_workers=min(num_workers, missing),
+                        priority=priority
+                    ):
+                if tuple(banner) not in known:
+                    known.add(tuple(banner))
+                    pool.append((banner, score))
+            pool.sort(key=lambda x: -x[1])
+        return [b for b, score in pool[:num_banners]]
+
+    def banner_keywords(
+        self, url, crawl,
+        keyword_generator, request_classifier,
+        title, content, banners,
+        keyword_temp=1.1, num_keywords=18,
+        num_workers=5, num_kw_workers=4,
+        priority=core.rate_limit.INTERACTIVE
+    ):
+        site = self._site(url, crawl) or SiteResults(title, content)
+        key = content_key(title, content)
+
+        def pool_key(banner):
+            return key, tuple(banner), keyword_temp, num_keywords
+
+        missing = [
+            banner for banner in banners
+            if pool_key(banner) not in site.keyword_pools
+        ]
+        generated = iter(())
+        if missing:
+            generated = core.generate_advertisement.generate_keywords_parallel(
+                keyword_generator, request_classifier,
+                title, content, missing,
+                keyword_temp=keyword_temp, num_keywords=num_keywords,
+                num_workers=min(num_workers, len(missing)),
+                num_kw_workers=num_kw_workers, priority=priority
+            )
+
+        # keep the banner order, streaming new results as they arrive
+        for banner in banners:
+            if pool_key(banner) not in site.keyword_pools:
+                for new_banner, keywords in generated:
+                    site.keyword_pools[pool_key(new_banner)] = keywords
+                    if new_banner == banner:
+                        break
+            if pool_key(banner) in site.keyword_pools:
+                yield banner, site.keyword_pools[pool_key(banner)]
@@ -0,0 +1,151 @@
+import os
+import time
+
+import core.shared_state
+
+
+INTERACTIVE = 0
+BATCH = 1
+
+
+def _env_float(name):
+    value = os.environ.get(name)
+    return float(value) if value else None
+
+
+# Limits are opt-in: set TTM_RATE_LIMIT to the backend quota in calls per
+# second, a generate call counts as num_hypos calls. TTM_RATE_BURST defaults
+# to one second of quota.
+default_rate = _env_float('TTM_RATE_LIMIT')
+default_capacity = _env_float('TTM_RATE_BURST') or default_rate
+# Share of the bucket batch calls must leave for interactive ones.
+batch_reserve = 0.5
+
+
+def call_cost(name, kwargs):
+    if name == 'generate':
+        return kwargs.get('num_hypos', 1)
+    return 1
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every thread and process of the user on the
+    host, together with queue wait statistics of its callers.
+    """
+
+    def __init__(self, name, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        # level, timestamp, calls, total wait, max wait
+        self.record = core.shared_state.SharedRecord(
+            'rate_limit_' + name, 5
+        )
+
+    def _take(self, tokens, reserve):
+        """
+        Takes tokens if the bucket keeps at least reserve afterwards,
+        returns 0 on success, otherwise the expected wait in seconds.
+        A call larger than the bucket waits for a full bucket and leaves
+        it in debt, so later calls pay for the rest.
+        """
+        with self.record.update() as values:
+            if values is None:
+                return 0.
+            now = time.time()
+            level, last = values[:2]
+            if last:
+                level = min(
+                    self.capacity, level + max(0., now - last) * self.rate
+                )
+            else:
+                level = self.capacity
+
+            needed = min(tokens, self.capacity) + reserve
+            if level >= needed:
+                level -= tokens
+                wait = 0.
+            else:
+                wait = (needed - level) / self.rate
+            values[:2] = level, now
+            return wait
+
+    def _record_wait(self, wait):
+        with self.record.update() as values:
+            if values is not None:
+                values[2] += 1
+                values[3] += wait
+                values[4] = max(values[4], wait)
+
+    def acquire(self, tokens=1, priority=INTERACTIVE):
+        """
+        Blocks until tokens are available, returns the time waited.
+        """
+        reserve = 0.
+        if priority == BATCH:
+            reserve = min(batch_reserve * self.capacity,
+                          self.capacity - min(tokens, self.capacity))
+        start = time.monotonic()
+        while True:
+            wait = self._take(tokens, reserve)
+            if not wait:
+                break
+            # others may refill or drain the bucket meanwhile, recheck
+            time.sleep(min(wait, 0.5))
+        wait = time.monotonic() - start
+        self._record_wait(wait)
+        return wait
+
+    def stats(self):
+        """
+        (calls, total wait, max wait) over every process, in seconds.
+        """
+        with self.record.update() as values:
+            if values is None:
+                return 0, 0., 0.
+            return int(values[2]), values[3], values[4]
+
+
+class RateLimitedModel:
+    """
+    Wraps a TuneTheModel so that generate and classify calls take tokens
+    from the bucket of its model id, at the priority given per call.
+    A generate call costs num_hypos tokens, a classify call one. Without
+    a rate the calls go straight to the model.
+    """
+
+    def __init__(self, model, model_id,
+                 rate=default_rate, capacity=default_capacity):
+        self.model = model
+        self.model_id = model_id
+        self.bucket = None
+        if rate:
+            self.bucket = TokenBucket(model_id, rate, capacity or rate)
+
+    def acquire(self, tokens, priority=INTERACTIVE):
+        if self.bucket is None:
+            return 0.
+        return self.bucket.acquire(tokens, priority)
+
+    def generate(self, *args, priority=INTERACTIVE, **kwargs):
+        self.acquire(call_cost('generate', kwargs), priority)
+        return self.model.generate(*args, **kwargs)
+
+    def classify(self, *args, priority=INTERACTIVE, **kwargs):
+        self.acquire(call_cost('classify', kwargs), priority)
+        return self.model.classify(*args, **kwargs)
+
+    def wait_stats(self):
+        """
+        (calls, total wait, max wait) of the model over every process,
+        None when not rate limited.
+        """
+        if self.bucket is None:
+            return None
+        return self.bucket.stats()
+
+    def __getattr__(self, name):
+        model = self.__dict__.get('model')
+        if model is None:
+            raise AttributeError(name)
+        return getattr(model, name)
@@ -0,0 +1,251 @@
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import json
+import os
+import sqlite3
+import time
+
+import core.pipeline
+
+
+default_path = os.environ.get('ADGEN_RESULT_STORE', 'results.sqlite3')
+
+schema = '''
+CREATE TABLE IF NOT EXISTS campaigns (
+    id INTEGER PRIMARY KEY,
+    domain TEXT NOT NULL,
+    url TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    params TEXT NOT NULL,
+    created REAL NOT NULL,
+    UNIQUE (content_hash, params)
+);
+CREATE INDEX IF NOT EXISTS campaigns_domain ON campaigns (domain);
+
+CREATE TABLE IF NOT EXISTS banners (
+    id INTEGER PRIMARY KEY,
+    campaign_id INTEGER NOT NULL
+        REFERENCES campaigns (id) ON DELETE CASCADE,
+    pos INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS banners_campaign ON banners (campaign_id, pos);
+
+CREATE TABLE IF NOT EXISTS keywords (
+    id INTEGER PRIMARY KEY,
+    banner_id INTEGER NOT NULL
+        REFERENCES banners (id) ON DELETE CASCADE,
+    pos INTEGER NOT NULL,
+    keyword TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS keywords_banner ON keywords (banner_id, pos);
+
+CREATE TABLE IF NOT EXISTS keyword_scores (
+    keyword_id INTEGER NOT NULL
+        REFERENCES keywords (id) ON DELETE CASCADE,
+    pos INTEGER NOT NULL,
+    property TEXT NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (keyword_id, property)
+);
+DROP INDEX IF EXISTS keyword_scores_property;
+'''
+
+export_query = '''
+SELECT c.domain, c.url, c.content_hash, c.params,
+       b.pos AS banner_pos, b.title, b.description,
+       k.pos AS keyword_pos, k.keyword, s.property, s.score
+FROM campaigns c
+JOIN banners b ON b.campaign_id = c.id
+JOIN keywords k ON k.banner_id = b.id
+JOIN keyword_scores s ON s.keyword_id = k.id
+ORDER BY c.id, b.pos, k.pos, s.pos
+'''
+
+
+def domain(url):
+    if '://' not in url:
+        url = '//' + url
+    host = urlparse(url).netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return host
+
+
+def params_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+class ResultStore:
+    """
+    Local SQLite store of generated campaigns: banners and keywords with
+    their full request_classifier_mapping score vectors, keyed by site
+    content hash and generation params.
+
+    A campaign is a list of (banner, keywords) as produced by the
+    pipeline, where banner is [title, description] and keywords is a list
+    of (keyword, scores) with scores a Property/Score DataFrame.
+    """
+
+    def __init__(self, path=default_path):
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(schema)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA foreign_keys = ON')
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def save(self, url, title, content, params, campaign):
+        content_hash = core.pipeline.content_key(title, content)
+        with self._connect() as conn:
+            conn.execute(
+                'DELETE FROM campaigns WHERE content_hash = ? AND params = ?',
+                (content_hash, params_key(params))
+            )
+            campaign_id = conn.execute(
+                'INSERT INTO campaigns '
+                '(domain, url, content_hash, params, created) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (domain(url), url, content_hash, params_key(params),
+                 time.time())
+            ).lastrowid
+            for banner_pos, (banner, keywords) in enumerate(campaign):
+                h, t = banner
+                banner_id = conn.execute(
+                    'INSERT INTO banners '
+                    '(campaign_id, pos, title, description) '
+                    'VALUES (?, ?, ?, ?)',
+                    (campaign_id, banner_pos, h, t)
+                ).lastrowid
+                for keyword_pos, (keyword, scores) in enumerate(keywords):
+                    keyword_id = conn.execute(
+                        'INSERT INTO keywords (banner_id, pos, keyword) '
+                        'VALUES (?, ?, ?)',
+                        (banner_id, keyword_pos, keyword)
+                    ).lastrowid
+                    conn.executemany(
+                        'INSERT INTO keyword_scores '
+                        '(keyword_id, pos, property, score) '
+                        'VALUES (?, ?, ?, ?)',
+                        [
+                            (keyword_id, pos, prop, float(score))
+                            for pos, (prop, score) in enumerate(
+                                zip(scores['Property'], scores['Score'])
+                            )
+                        ]
+                    )
+
+    def load(self, title, content, params):
+        """
+        Returns the stored campaign or None.
+        """
+        import pandas as pd
+        content_hash = core.pipeline.content_key(title, content)
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT id FROM campaigns '
+                'WHERE content_hash = ? AND params = ?',
+                (content_hash, params_key(params))
+            ).fetchone()
+            if row is None:
+                return None
+            rows = conn.execute(
+                'SELECT b.id, b.title, b.description, k.id, k.keyword, '
+                's.property, s.score '
+                'FROM banners b '
+                'LEFT JOIN keywords k ON k.banner_id = b.id '
+                'LEFT JOIN keyword_scores s ON s.keyword_id = k.id '
+                'WHERE b.campaign_id = ? '
+                'ORDER BY b.pos, k.pos, s.pos',
+                (row[0],)
+            ).fetchall()
+
+        banners = {}
+        for banner_id, h, t, keyword_id, keyword, prop, score in rows:
+            keywords = banners.setdefault(banner_id, ([h, t], {}))[1]
+            if keyword_id is not None:
+                keywords.setdefault(keyword_id, (keyword, [], []))
+                keywords[keyword_id][1].append(prop)
+                keywords[keyword_id][2].append(score)
+
+        return [
+            (banner, [
+                (keyword, pd.DataFrame.from_dict(
+                    {'Property': props, 'Score': scores}
+                ))
+                for keyword, props, scores in keywords.values()
+            ])
+            for banner, keywords in banners.values()
+        ]
+
+    def top_keywords(self, site, prop='Exact match', limit=20):
+        """
+        Best scored distinct keywords by prop over every campaign
+        stored for the domain of site.
+        """
+        # CROSS JOIN keeps this join order: campaigns by the domain index,
+        # then down the per-parent indexes to the score primary key.
+        with self._connect() as conn:
+            return conn.execute(
+                'SELECT k.keyword, MAX(s.score) AS score '
+                'FROM campaigns c '
+                'CROSS JOIN banners b ON b.campaign_id = c.id '
+                'CROSS JOIN keywords k ON k.banner_id = b.id '
+                'CROSS JOIN keyword_scores s ON s.keyword_id = k.id '
+                'WHERE c.domain = ? AND s.property = ? '
+                'GROUP BY k.keyword '
+                'ORDER BY score DESC '
+                'LIMIT ?',
+                (domain(site), prop, limit)
+            ).fetchall()
+
+    def export(self, path):
+        """
+        Writes every stored keyword as one row with a column per score
+        property. The format is chosen by extension: .csv or .parquet
+        (the latter needs pyarrow or fastparquet).
+        """
+        import pandas as pd
+        with self._connect() as conn:
+            df = pd.read_sql_query(export_query, conn)
+        index = [c for c in df.columns if c not in ('property', 'score')]
+        df = df.pivot_table(
+            index=index, columns='property', values='score', sort=False
+        ).reset_index()
+        df.columns.name = None
+        if path.endswith('.parquet'):
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=False)
+        return len(df)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default=default_path)
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export')
+    export.add_argument('path')
+    top = commands.add_parser('top')
+    top.add_argument('site')
+    top.add_argument('--property', default='Exact match')
+    top.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    store = ResultStore(args.db)
+    if args.command == 'export':
+        print(store.export(args.path), 'keywords exported')
+    else:
+        for keyword, score in store.top_keywords(
+            args.site, args.property, args.limit
+        ):
+            print('{:.3f}\t{}'.format(score, keyword))
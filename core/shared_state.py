@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+import os
+import struct
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # no flock, shared within the process only
+    fcntl = None
+
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _reset_locks():
+    # A forked child may inherit locks held by other threads of the
+    # parent, which would never be released there.
+    global _locks, _locks_lock
+    _locks = {}
+    _locks_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_locks)
+
+
+def _thread_lock(path):
+    with _locks_lock:
+        return _locks.setdefault(path, threading.Lock())
+
+
+class SharedRecord:
+    """
+    Fixed number of floats kept in a temp file of the current user, shared
+    by every thread and process on the host.
+    """
+
+    def __init__(self, name, size, directory=None):
+        self.format = '{}d'.format(size)
+        self.size = size
+        user = str(os.getuid()) if hasattr(os, 'getuid') else ''
+        self.path = os.path.join(
+            directory or tempfile.gettempdir(),
+            'ttm_{}_{}'.format(user, name)
+        )
+
+    @contextmanager
+    def update(self):
+        """
+        Yields the values as a list (zeros for a new record) under an
+        exclusive lock and writes them back. Yields None if the file can
+        not be used, callers then go on without the shared state.
+        """
+        with _thread_lock(self.path):
+            try:
+                fd = os.open(
+                    self.path,
+                    os.O_RDWR | os.O_CREAT | getattr(os, 'O_CLOEXEC', 0),
+                    0o600
+                )
+            except OSError:
+                yield None
+                return
+
+            try:
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(fd, fcntl.LOCK_EX)
+                    data = os.read(fd, struct.calcsize(self.format))
+                except OSError:
+                    yield None
+                    return
+
+                if len(data) == struct.calcsize(self.format):
+                    values = list(struct.unpack(self.format, data))
+                else:
+                    values = [0.] * self.size
+                yield values
+                try:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    os.write(fd, struct.pack(self.format, *values))
+                except OSError:
+                    pass
+            finally:
+                # A child forked meanwhile shares this open file, closing
+                # our descriptor alone would leave the lock held by it.
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
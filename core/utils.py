@@ -5,22 +5,22 @@ import string
 _all_en_words = None
 _bad_en_words = None
 _stop_words = None
+_language_identifier = None
 
 
-def init():
-    global _all_en_words, _bad_en_words, _stop_words
+def _load_corpus(name):
     import nltk
-    nltk.download("stopwords")
-    nltk.download("words")
-
-    from nltk.corpus import words
-    _all_en_words = set(words.words())
+    try:
+        nltk.data.find('corpora/' + name)
+    except LookupError:
+        nltk.download(name)
+    return getattr(nltk.corpus, name)
 
-    from nltk.corpus import stopwords
-    _stop_words = set(stopwords.words('english'))
 
-    with open('core/english_ban.txt') as f:
-        _bad_en_words = set(f.read().split('\n'))
+def init():
+    get_all_en_words()
+    get_bad_en_words()
+    get_stop_words()
 
 
 def choose(arr, prev=""):
@@ -28,23 +28,40 @@ def choose(arr, prev=""):
 
 
 def get_all_en_words():
+    global _all_en_words
     if _all_en_words is None:
-        init()
+        _all_en_words = set(_load_corpus('words').words())
     return _all_en_words
 
 
 def get_bad_en_words():
+    global _bad_en_words
     if _bad_en_words is None:
-        init()
+        with open('core/english_ban.txt') as f:
+            _bad_en_words = set(f.read().split('\n'))
     return _bad_en_words
 
 
 def get_stop_words():
+    global _stop_words
     if _stop_words is None:
-        init()
+        _stop_words = set(_load_corpus('stopwords').words('english'))
     return _stop_words
 
 
+def get_language_identifier():
+    # Loaded once per process; processes forked afterwards share it.
+    global _language_identifier
+    if _language_identifier is None:
+        from langid.langid import LanguageIdentifier, model
+        _language_identifier = LanguageIdentifier.from_modelstring(model)
+    return _language_identifier
+
+
+def classify_language(text):
+    return get_language_identifier().classify(text)
+
+
 def is_fraud(text):
     all_en_words = get_all_en_words()
 